@@ -0,0 +1,30 @@
+"""
+Gunicorn configuration for the Genre Analysis Service
+-----------------------------------------------------
+Run with: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+
+bind = '127.0.0.1:8002'
+worker_class = 'gevent'
+workers = os.cpu_count() or 1
+worker_connections = 1000
+pythonpath = os.path.dirname(os.path.abspath(__file__))
+
+# Load the app and build its movie/history caches once in the master, so
+# workers share them copy-on-write instead of each parsing the data files
+preload_app = True
+
+def pre_fork(server, worker):
+    """Flush and stop the master's log listener so workers don't inherit it mid-write
+
+    The master logs straight to the file from then on.
+    """
+    import service_c
+    service_c.stop_log_listener()
+
+def post_fork(server, worker):
+    """Give each worker its own log listener thread"""
+    import service_c
+    service_c.start_log_listener()
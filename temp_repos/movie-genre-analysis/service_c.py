@@ -4,19 +4,81 @@ Microservice C: Genre Analysis Service
 Categorizes movies and identifies genre patterns.
 """
 
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, request
+import orjson
 import os
+import gzip
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
+import time
+import functools
 from datetime import datetime
-from collections import Counter
+from operator import itemgetter
+import numpy as np
 
-# Configure logging
-logging.basicConfig(
-    filename='genre_analysis_service.log',
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s:%(message)s'
-)
+try:
+    from numba import njit
+except ImportError:  # Numba is optional, the NumPy fallback below is used instead
+    njit = None
+
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:  # gevent is only needed when serving through wsgi.py
+    gevent_monkey = None
+
+class LogListener(QueueListener):
+    """QueueListener that stays on a real OS thread when gevent has patched threading"""
+    
+    _pool_result = None
+    
+    def start(self):
+        if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+            # A patched thread is just a greenlet, whose file writes would still block the event loop
+            import gevent
+            self._pool_result = gevent.get_hub().threadpool.spawn(self._monitor)
+        else:
+            super().start()
+    
+    def stop(self):
+        if self._pool_result is None:
+            super().stop()
+        else:
+            self.enqueue_sentinel()
+            self._pool_result.get()
+            self._pool_result = None
+
+# Configure logging: request threads only enqueue records, and a background
+# listener thread writes them to the log file. The queue is the C SimpleQueue,
+# even under gevent, since it's shared with a real OS thread.
+log_queue = (gevent_monkey.get_original('queue', 'SimpleQueue') if gevent_monkey else queue.SimpleQueue)()
+log_file_handler = logging.FileHandler('genre_analysis_service.log')
+log_file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
+log_queue_handler = QueueHandler(log_queue)
+logging.getLogger().setLevel(logging.INFO)
+log_listener = None
+
+def start_log_listener():
+    """Route log records through the queue to a background listener thread"""
+    global log_listener
+    log_listener = LogListener(log_queue, log_file_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logging.getLogger().removeHandler(log_file_handler)
+    logging.getLogger().addHandler(log_queue_handler)
+
+def stop_log_listener():
+    """Write out any queued log records, stop the listener thread and log to the file directly"""
+    global log_listener
+    if log_listener is not None:
+        logging.getLogger().removeHandler(log_queue_handler)
+        logging.getLogger().addHandler(log_file_handler)
+        atexit.unregister(log_listener.stop)
+        log_listener.stop()
+        log_listener = None
+
+start_log_listener()
 
 app = Flask(__name__)
 
@@ -30,25 +92,304 @@ DATA_DIR = '../data'
 MOVIES_FILE = os.path.join(DATA_DIR, 'movies.json')
 HISTORY_FILE = os.path.join(DATA_DIR, 'history.json')
 
+def ojsonify(obj):
+    """Build a JSON response, serialized with orjson instead of Flask's jsonify"""
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS),
+                              mimetype='application/json')
+
+# Current second and its ISO timestamp: (seconds, iso_string)
+_TS_CACHE = (0, '')
+
+def iso_now():
+    """Get the current time as an ISO string, formatted at most once per second"""
+    global _TS_CACHE
+    now = int(time.time())
+    if _TS_CACHE[0] != now:
+        _TS_CACHE = (now, datetime.fromtimestamp(now).isoformat())
+    return _TS_CACHE[1]
+
 def read_json_file(filename):
     """Read and parse a JSON file"""
     try:
-        with open(filename, 'r') as f:
-            data = json.load(f)
+        with open(filename, 'rb') as f:
+            data = orjson.loads(f.read())
             logging.info(f"Read data from {filename}.")
             return data
     except FileNotFoundError:
         logging.error(f"File not found: {filename}")
         return {}
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logging.error(f"JSON decode error in {filename}: {str(e)}")
         return {}
 
+def get_mtime(filename):
+    """Get a file's modification time in nanoseconds, or None if it doesn't exist"""
+    try:
+        return os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        logging.error(f"File not found: {filename}")
+        return None
+
+def _count_decade_genre(decade_ids, genre_ids, n_genres, n_decades):
+    """Count movies into an n_decades x n_genres matrix"""
+    combo = decade_ids * n_genres + genre_ids
+    return np.bincount(combo, minlength=n_decades * n_genres).reshape(n_decades, n_genres)
+
+if njit is not None:
+    @njit('int64[:, :](int64[:], int32[:], int64, int64)', cache=True)
+    def _count_decade_genre(decade_ids, genre_ids, n_genres, n_decades):
+        """Count movies into an n_decades x n_genres matrix in one compiled loop"""
+        counts = np.zeros((n_decades, n_genres), dtype=np.int64)
+        for i in range(decade_ids.size):
+            counts[decade_ids[i], genre_ids[i]] += 1
+        return counts
+
+def _parse_year(release_date):
+    """Get the year from a release date, e.g. 1999 from '1999-03-31'"""
+    # Fast path for ISO dates, avoiding split() and int()'s general parser
+    head = release_date[:4]
+    if len(head) == 4 and head.isascii() and head.isdigit() and release_date[4:5] in ('', '-'):
+        return ((ord(head[0]) - 48) * 1000 + (ord(head[1]) - 48) * 100
+                + (ord(head[2]) - 48) * 10 + (ord(head[3]) - 48))
+    return int(release_date.split('-')[0])
+
+def _intern_genre(genre):
+    """Intern a genre name so dict lookups on it can compare by identity"""
+    return sys.intern(genre) if isinstance(genre, str) else genre
+
+def _build_cache(movies):
+    """Factorize movie genres and count movies by genre and by decade"""
+    for movie in movies:
+        movie['genre'] = _intern_genre(movie['genre'])
+    
+    # Factorize genres to int IDs in order of first appearance, which keeps
+    # ties in the same order Counter.most_common() would give them
+    get_genre = itemgetter('genre')
+    genre_names = list(dict.fromkeys(map(get_genre, movies)))
+    genre_index = {genre: i for i, genre in enumerate(genre_names)}
+    genre_ids = np.fromiter(map(genre_index.__getitem__, map(get_genre, movies)),
+                            dtype=np.int32, count=len(movies))
+    n_genres = len(genre_names)
+    
+    # Parse release years, flagging movies with missing or invalid release dates
+    years = np.zeros(len(movies), dtype=np.int64)
+    has_year = np.ones(len(movies), dtype=bool)
+    for i, movie in enumerate(movies):
+        try:
+            years[i] = _parse_year(movie.get('release_date'))
+        except (ValueError, IndexError, KeyError, TypeError, AttributeError, OverflowError):
+            has_year[i] = False
+    
+    # Index only the decades that occur, so outlier years don't widen the matrix,
+    # then count every (decade, genre) pair in a single pass
+    decades, decade_ids = np.unique((years[has_year] // 10) * 10, return_inverse=True)
+    decade_counts = _count_decade_genre(decade_ids.astype(np.int64), genre_ids[has_year], n_genres, decades.size)
+    
+    # List each decade's genre IDs in order of first appearance in that decade,
+    # so its top genres break ties the way a per-decade Counter would
+    pairs, first_seen = np.unique(decade_ids * n_genres + genre_ids[has_year], return_index=True)
+    pairs = pairs[np.argsort(first_seen)]
+    pairs = pairs[np.argsort(pairs // n_genres, kind='stable')]
+    decade_sizes = np.bincount(pairs // n_genres, minlength=decades.size)
+    decade_genres = np.split(pairs % n_genres, np.cumsum(decade_sizes)[:-1])
+    
+    return {
+        "total_movies": len(movies),
+        "genre_names": genre_names,
+        "genre_index": genre_index,
+        "genre_counts": np.bincount(genre_ids, minlength=n_genres),
+        "decades": decades.tolist(),  # e.g., 1990, 2000, 2010
+        "decade_counts": decade_counts,
+        "decade_genres": decade_genres
+    }
+
+def _most_common(counts, genre_names, n=None, order=None):
+    """List (genre, count) pairs from most to least common, like Counter.most_common()"""
+    # order lists the genre IDs to rank, in the order their ties come out (by default all of them, by ID)
+    if order is not None:
+        counts = counts[order]
+    # Unique ranking keys: by count, then by position in order for ties
+    keys = counts * counts.size + np.arange(counts.size - 1, -1, -1)
+    if n is not None and n < counts.size:
+        # Only the top n need sorting
+        top = np.argpartition(-keys, n)[:n]
+        top = top[np.argsort(-keys[top])]
+    else:
+        top = np.argsort(-keys)
+    if order is None:
+        return [(genre_names[i], int(counts[i])) for i in top if counts[i]]
+    return [(genre_names[order[i]], int(counts[i])) for i in top if counts[i]]
+
+# Responses smaller than this (in bytes) aren't worth compressing
+COMPRESS_MIN_SIZE = 512
+
+# Stands in for the timestamp in frozen response bodies until it's spliced in per request
+_TIMESTAMP_PLACEHOLDER = '__TIMESTAMP__'
+
+def _freeze(obj):
+    """Serialize a response body once, split around its timestamp placeholder"""
+    head, _, tail = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).rpartition(_TIMESTAMP_PLACEHOLDER.encode())
+    return head, tail
+
+def frozen_response(movie_data, name):
+    """Build a JSON response from a frozen body with the current timestamp spliced in"""
+    # The body only changes with movies.json, so its mtime doubles as a (weak) ETag
+    etag = str(movie_data['mtime_ns'])
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        head, tail = movie_data['responses'][name]
+        timestamp = iso_now()
+        body = head + timestamp.encode() + tail
+        if len(body) >= COMPRESS_MIN_SIZE and request.accept_encodings['gzip']:
+            # The body only changes once a second, so compress it at most that often
+            compressed = movie_data['compressed'].get(name)
+            if compressed is None or compressed[0] != timestamp:
+                compressed = (timestamp, gzip.compress(body, 6))
+                movie_data['compressed'][name] = compressed
+            response = app.response_class(compressed[1], mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def _build_responses(movie_data):
+    """Serialize the bodies of the endpoints that only depend on movies data"""
+    genre_names = movie_data['genre_names']
+    genre_counts = movie_data['genre_counts']
+    total_movies = movie_data['total_movies']
+    
+    # All genres with movie counts, by name
+    genres = [
+        {"name": genre, "count": count}
+        for genre, count in sorted(zip(genre_names, genre_counts.tolist()))
+    ]
+    
+    # Get top genres (limit to top 5)
+    popular = [
+        {"name": genre, "count": count, "percentage": round((count / total_movies) * 100, 1)}
+        for genre, count in _most_common(genre_counts, genre_names, 5)
+    ]
+    
+    # Format decade data
+    decade_analysis = []
+    for decade, counts, seen in zip(movie_data['decades'], movie_data['decade_counts'], movie_data['decade_genres']):
+        total = int(counts.sum())
+        top_genres = _most_common(counts, genre_names, 3, order=seen)
+        decade_analysis.append({
+            "decade": f"{decade}s",
+            "top_genres": [
+                {"name": genre, "count": count}
+                for genre, count in top_genres
+            ],
+            "total_movies": total
+        })
+    
+    return {
+        "genres": _freeze({
+            "genres": genres,
+            "total_movies": total_movies,
+            "timestamp": _TIMESTAMP_PLACEHOLDER
+        }),
+        "popular": _freeze({
+            "popular_genres": popular,
+            "total_movies": total_movies,
+            "timestamp": _TIMESTAMP_PLACEHOLDER
+        }),
+        "analysis": _freeze({
+            "genres": genres,
+            "decades": decade_analysis,
+            "total_movies": total_movies,
+            "timestamp": _TIMESTAMP_PLACEHOLDER
+        })
+    }
+
+@functools.lru_cache(maxsize=1)
+def _movie_data_for(filename, mtime_ns):
+    """Build the movie arrays, aggregates and responses for one version of a movies file"""
+    # The parsed movie dicts are only needed while building the arrays
+    movies = read_json_file(filename)
+    if not movies:
+        return None
+    movie_data = _build_cache(movies)
+    movie_data['mtime_ns'] = mtime_ns
+    movie_data['responses'] = _build_responses(movie_data)
+    movie_data['compressed'] = {}  # Gzipped responses: {name: (timestamp, bytes)}
+    return movie_data
+
+def get_movie_data():
+    """Get the cached movie arrays and aggregates, rebuilding them if movies.json changed"""
+    mtime_ns = get_mtime(MOVIES_FILE)
+    if mtime_ns is None:
+        return None
+    movie_data = _movie_data_for(MOVIES_FILE, mtime_ns)
+    if movie_data is None:
+        # Don't keep a failed read cached, the file may be rewritten without its mtime changing
+        _movie_data_for.cache_clear()
+    return movie_data
+
+def _count_user_genres(genre_ids, n_genres):
+    """Count how many of a user's watched movies fall in each genre"""
+    return np.bincount(genre_ids, minlength=n_genres)
+
+if njit is not None:
+    @njit('int64[:](int32[:], int64)', cache=True)
+    def _count_user_genres(genre_ids, n_genres):
+        """Count how many of a user's watched movies fall in each genre in one compiled loop"""
+        counts = np.zeros(n_genres, dtype=np.int64)
+        for i in range(genre_ids.size):
+            counts[genre_ids[i]] += 1
+        return counts
+
+# Watch history indexed by user, keyed on the mtimes of both the movies and history files
+_HISTORY_CACHE = {}
+
+def _index_history(history, movie_data):
+    """Convert each user's watch history into an array of genre IDs, and those IDs in order of first watch"""
+    # Genres that only appear in watch history get IDs after the movie genres
+    genre_names = list(movie_data['genre_names'])
+    genre_index = dict(movie_data['genre_index'])
+    
+    user_history = {}
+    for user_id, watched in history.items():
+        genre_ids = []
+        for movie in watched:
+            if 'genre' not in movie:
+                continue
+            genre = _intern_genre(movie['genre'])
+            if genre not in genre_index:
+                genre_index[genre] = len(genre_names)
+                genre_names.append(genre)
+            genre_ids.append(genre_index[genre])
+        # Ties in the user's breakdown go in order of first watch, like Counter.most_common()
+        seen = np.fromiter(dict.fromkeys(genre_ids), dtype=np.int32)
+        user_history[user_id] = (np.array(genre_ids, dtype=np.int32), seen, len(watched))
+    
+    return user_history, genre_names
+
+def get_user_history(movie_data):
+    """Get the cached per-user watch history index and the genre names its IDs refer to"""
+    mtime_ns = get_mtime(HISTORY_FILE)
+    if mtime_ns is None:
+        return {}, movie_data['genre_names']
+    
+    key = (movie_data['mtime_ns'], mtime_ns)
+    cached = _HISTORY_CACHE.get(HISTORY_FILE)
+    if cached is None or cached[0] != key:
+        history = read_json_file(HISTORY_FILE)
+        if not history:
+            return {}, movie_data['genre_names']
+        cached = (key, _index_history(history, movie_data))
+        _HISTORY_CACHE[HISTORY_FILE] = cached
+    return cached[1]
+
 @app.route('/')
 def home():
     """Home route with API info"""
     logging.info(f"Received {request.method} request on {request.path}")
-    return jsonify({
+    return ojsonify({
         "message": "Genre Analysis Service API",
         "endpoints": [
             "/genres - List all genres with movie counts",
@@ -62,7 +403,7 @@ def home():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+    return ojsonify({"status": "healthy", "timestamp": iso_now()})
 
 @app.route('/genres', methods=['GET'])
 def list_genres():
@@ -70,30 +411,17 @@ def list_genres():
     logging.info(f"Received request to list genres")
     
     try:
-        # Get all movies
-        movies = read_json_file(MOVIES_FILE)
-        if not movies:
-            return jsonify({"error": "Could not read movies data"}), 500
-        
-        # Count movies by genre
-        genre_counts = Counter([movie['genre'] for movie in movies])
+        # Get the cached movie data and genre counts
+        movie_data = get_movie_data()
+        if movie_data is None:
+            return ojsonify({"error": "Could not read movies data"}), 500
         
-        # Format response
-        genres = [
-            {"name": genre, "count": count}
-            for genre, count in sorted(genre_counts.items())
-        ]
-        
-        logging.info(f"Found {len(genres)} genres")
-        return jsonify({
-            "genres": genres,
-            "total_movies": len(movies),
-            "timestamp": datetime.now().isoformat()
-        })
+        logging.info(f"Found {len(movie_data['genre_names'])} genres")
+        return frozen_response(movie_data, 'genres')
         
     except Exception as e:
         logging.error(f"Error listing genres: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}), 500
 
 @app.route('/genres/popular', methods=['GET'])
 def popular_genres():
@@ -101,33 +429,17 @@ def popular_genres():
     logging.info(f"Received request for popular genres")
     
     try:
-        # Get all movies
-        movies = read_json_file(MOVIES_FILE)
-        if not movies:
-            return jsonify({"error": "Could not read movies data"}), 500
+        # Get the cached movie data and genre counts
+        movie_data = get_movie_data()
+        if movie_data is None:
+            return ojsonify({"error": "Could not read movies data"}), 500
         
-        # Count movies by genre
-        genre_counts = Counter([movie['genre'] for movie in movies])
-        
-        # Get top genres (limit to top 5)
-        top_genres = genre_counts.most_common(5)
-        
-        # Format response
-        popular = [
-            {"name": genre, "count": count, "percentage": round((count / len(movies)) * 100, 1)}
-            for genre, count in top_genres
-        ]
-        
-        logging.info(f"Found {len(popular)} popular genres")
-        return jsonify({
-            "popular_genres": popular,
-            "total_movies": len(movies),
-            "timestamp": datetime.now().isoformat()
-        })
+        logging.info(f"Found {min(len(movie_data['genre_names']), 5)} popular genres")
+        return frozen_response(movie_data, 'popular')
         
     except Exception as e:
         logging.error(f"Error getting popular genres: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}), 500
 
 @app.route('/genres/analysis', methods=['GET'])
 def genre_analysis():
@@ -135,59 +447,17 @@ def genre_analysis():
     logging.info(f"Received request for genre analysis")
     
     try:
-        # Get all movies
-        movies = read_json_file(MOVIES_FILE)
-        if not movies:
-            return jsonify({"error": "Could not read movies data"}), 500
-        
-        # Count movies by genre
-        genre_counts = Counter([movie['genre'] for movie in movies])
-        
-        # Analyze genres by decade
-        decades = {}
-        for movie in movies:
-            try:
-                year = int(movie['release_date'].split('-')[0])
-                decade = (year // 10) * 10  # e.g., 1990, 2000, 2010
-                
-                if decade not in decades:
-                    decades[decade] = Counter()
-                
-                decades[decade][movie['genre']] += 1
-            except (ValueError, IndexError):
-                # Skip movies with invalid release dates
-                continue
-        
-        # Format decade data
-        decade_analysis = []
-        for decade, counts in sorted(decades.items()):
-            top_genres = counts.most_common(3)
-            decade_analysis.append({
-                "decade": f"{decade}s",
-                "top_genres": [
-                    {"name": genre, "count": count}
-                    for genre, count in top_genres
-                ],
-                "total_movies": sum(counts.values())
-            })
-        
-        # Format response
-        analysis = {
-            "genres": [
-                {"name": genre, "count": count}
-                for genre, count in sorted(genre_counts.items())
-            ],
-            "decades": decade_analysis,
-            "total_movies": len(movies),
-            "timestamp": datetime.now().isoformat()
-        }
+        # Get the cached movie data with genre and per-decade counts
+        movie_data = get_movie_data()
+        if movie_data is None:
+            return ojsonify({"error": "Could not read movies data"}), 500
         
         logging.info(f"Completed genre analysis")
-        return jsonify(analysis)
+        return frozen_response(movie_data, 'analysis')
         
     except Exception as e:
         logging.error(f"Error performing genre analysis: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}), 500
 
 @app.route('/genres/user/<int:user_id>', methods=['GET'])
 def user_genre_analysis(user_id):
@@ -195,17 +465,17 @@ def user_genre_analysis(user_id):
     logging.info(f"Received request for user {user_id} genre analysis")
     
     try:
-        # Get all movies
-        movies = read_json_file(MOVIES_FILE)
-        if not movies:
-            return jsonify({"error": "Could not read movies data"}), 500
+        # Get the cached movie data and genre IDs
+        movie_data = get_movie_data()
+        if movie_data is None:
+            return ojsonify({"error": "Could not read movies data"}), 500
         
-        # Get user history
-        history = read_json_file(HISTORY_FILE)
-        user_history = history.get(str(user_id), [])
+        # Get user history as an array of genre IDs
+        user_history, genre_names = get_user_history(movie_data)
+        genre_ids, seen, watched_movies = user_history.get(str(user_id), (None, None, 0))
         
-        if not user_history:
-            return jsonify({
+        if not watched_movies:
+            return ojsonify({
                 "user_id": user_id,
                 "message": "No watch history found for this user",
                 "genres": [],
@@ -213,35 +483,42 @@ def user_genre_analysis(user_id):
             })
         
         # Count genres in user history
-        genre_counts = Counter([movie['genre'] for movie in user_history if 'genre' in movie])
+        genre_counts = _count_user_genres(genre_ids, len(genre_names))
+        breakdown = _most_common(genre_counts, genre_names, order=seen)
         
         # Get user's top genres
-        top_genres = [genre for genre, _ in genre_counts.most_common()]
+        top_genres = [genre for genre, _ in breakdown]
         
         # Find underrepresented genres (genres with movies but user hasn't watched)
-        all_genres = set(movie['genre'] for movie in movies)
-        unwatched_genres = all_genres - set(genre_counts.keys())
+        n_movie_genres = len(movie_data['genre_names'])
+        unwatched_genres = [genre_names[i] for i in np.where(genre_counts[:n_movie_genres] == 0)[0]]
         
         # Format response
         analysis = {
             "user_id": user_id,
-            "watched_movies": len(user_history),
+            "watched_movies": watched_movies,
             "genre_breakdown": [
-                {"name": genre, "count": count, "percentage": round((count / len(user_history)) * 100, 1)}
-                for genre, count in genre_counts.most_common()
+                {"name": genre, "count": count, "percentage": round((count / watched_movies) * 100, 1)}
+                for genre, count in breakdown
             ],
             "top_genres": top_genres[:3],
-            "suggested_new_genres": list(unwatched_genres)[:3],
-            "timestamp": datetime.now().isoformat()
+            "suggested_new_genres": unwatched_genres[:3],
+            "timestamp": iso_now()
         }
         
         logging.info(f"Completed genre analysis for user {user_id}")
-        return jsonify(analysis)
+        return ojsonify(analysis)
         
     except Exception as e:
         logging.error(f"Error performing user genre analysis: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return ojsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
     print(f"Starting Genre Analysis Service on port 8002...")
-    app.run(host='127.0.0.1', port=8002, debug=False)
+    # Serve through gunicorn with gevent workers (see gunicorn.conf.py and wsgi.py) instead of Flask's dev server
+    service_dir = os.path.dirname(os.path.abspath(__file__))
+    os.execvp(sys.executable, [
+        sys.executable, '-m', 'gunicorn',
+        '-c', os.path.join(service_dir, 'gunicorn.conf.py'),
+        'wsgi:app'
+    ])
@@ -0,0 +1,25 @@
+"""
+WSGI entry point for the Genre Analysis Service
+-----------------------------------------------
+Serves service_c's app through gunicorn with gevent workers:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+# Make file and socket IO cooperative before anything else is imported
+from gevent import monkey
+monkey.patch_all()
+
+import gc
+from service_c import app, get_movie_data, get_user_history
+
+def _prime_cache():
+    """Build the movie and history caches before gunicorn forks its workers"""
+    movie_data = get_movie_data()
+    if movie_data is not None:
+        get_user_history(movie_data)
+
+_prime_cache()
+
+# Keep the cached objects out of future GC passes, which would otherwise
+# write to their pages and undo the copy-on-write sharing
+gc.freeze()